@@ -1,6 +1,9 @@
-from flask import Flask, render_template, request, jsonify
-from datetime import datetime
-import csv, os, requests
+from flask import Flask, render_template, request
+from time import time, gmtime, strftime
+from concurrent.futures import ThreadPoolExecutor
+import atexit, os, queue, re, threading, orjson, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -8,33 +11,75 @@ load_dotenv()
 
 app = Flask(__name__)
 
+# Pipedrive config is static for the lifetime of the process, so resolve it once
+_PD_TOKEN = os.getenv('PIPEDRIVE_API_TOKEN')
+_PD_DOMAIN = os.getenv('PIPEDRIVE_DOMAIN')
+_PD_ENABLED = bool(_PD_TOKEN and _PD_DOMAIN)
+_PD_BASE_URL = f'https://{_PD_DOMAIN}.pipedrive.com/api/v1'
+_PD_PERSONS_URL = f'{_PD_BASE_URL}/persons'
+_PD_LEADS_URL = f'{_PD_BASE_URL}/leads'
+_PD_NOTES_URL = f'{_PD_BASE_URL}/notes'
+_PD_PARAMS = {'api_token': _PD_TOKEN}
+
+_NOTE_SOURCE = 'Quelle: Better Call HENK Beta Landing Page'
+
+# Loose sanity check only - enough to keep bot/junk submissions out of the CRM
+_EMAIL_RE = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+
+# Background workers for CRM sync, so /api/subscribe doesn't wait on Pipedrive
+_pipedrive_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='pipedrive')
+
+# Retry rate limits (honouring Retry-After) and outages with backoff. Only
+# statuses where Pipedrive did not process the POST are retried, and never
+# read timeouts, so a retry can't create duplicate Persons/Leads.
+_pipedrive_retry = Retry(
+    total=5,
+    read=0,
+    backoff_factor=0.5,
+    status_forcelist=(429, 503),
+    allowed_methods=frozenset(['POST']),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# Shared HTTP session: Person/Lead/Note calls reuse one keep-alive TLS connection
+_pipedrive_session = requests.Session()
+_pipedrive_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=_pipedrive_retry))
+# Bodies are pre-serialized with orjson, so the content type is set once here
+_pipedrive_session.headers['Content-Type'] = 'application/json'
+
 def send_to_pipedrive(data):
     """
     Send lead data to Pipedrive CRM (optional).
     Returns True if successful, False otherwise.
     """
-    api_token = os.getenv('PIPEDRIVE_API_TOKEN')
-    domain = os.getenv('PIPEDRIVE_DOMAIN')
-
     # Skip if Pipedrive is not configured
-    if not api_token or not domain:
+    if not _PD_ENABLED:
         return False
 
-    try:
-        base_url = f'https://{domain}.pipedrive.com/api/v1'
-        params = {'api_token': api_token}
+    # Skip submissions without any usable contact, they'd only create empty Persons
+    # Invalid addresses are dropped entirely, never sent to the CRM
+    email = data.get('email')
+    email = email if isinstance(email, str) and _EMAIL_RE.fullmatch(email) else None
+    whatsapp = data.get('whatsapp')
+    if not (whatsapp or email):
+        return False
 
+    display_name = data.get('name') or email or 'Beta User'
+    usecase = data.get('usecase')
+
+    try:
         # Step 1: Create Person in Pipedrive
         person_data = {
-            'name': data.get('name') or data.get('email', 'Beta User'),
-            'email': [{'value': data.get('email'), 'primary': True, 'label': 'work'}] if data.get('email') else [],
-            'phone': [{'value': data.get('whatsapp'), 'primary': True, 'label': 'mobile'}] if data.get('whatsapp') else []
+            'name': display_name,
+            'email': [{'value': email, 'primary': True, 'label': 'work'}] if email else [],
+            'phone': [{'value': whatsapp, 'primary': True, 'label': 'mobile'}] if whatsapp else []
         }
 
-        person_response = requests.post(
-            f'{base_url}/persons',
-            params=params,
-            json=person_data,
+        person_response = _pipedrive_session.post(
+            _PD_PERSONS_URL,
+            params=_PD_PARAMS,
+            data=orjson.dumps(person_data),
             timeout=10
         )
 
@@ -42,18 +87,18 @@ def send_to_pipedrive(data):
             print(f"Pipedrive Person Error: {person_response.status_code}")
             return False
 
-        person_id = person_response.json().get('data', {}).get('id')
+        person_id = orjson.loads(person_response.content).get('data', {}).get('id')
 
         # Step 2: Create Lead in Pipedrive
         lead_data = {
-            'title': f'Beta Anmeldung: {data.get("name") or data.get("email")}',
+            'title': f'Beta Anmeldung: {display_name}',
             'person_id': person_id,
         }
 
-        lead_response = requests.post(
-            f'{base_url}/leads',
-            params=params,
-            json=lead_data,
+        lead_response = _pipedrive_session.post(
+            _PD_LEADS_URL,
+            params=_PD_PARAMS,
+            data=orjson.dumps(lead_data),
             timeout=10
         )
 
@@ -61,10 +106,10 @@ def send_to_pipedrive(data):
             print(f"Pipedrive Lead Error: {lead_response.status_code}")
             return False
 
-        lead_id = lead_response.json().get('data', {}).get('id')
+        lead_id = orjson.loads(lead_response.content).get('data', {}).get('id')
 
         # Step 3: Create Note for the Lead (note field is deprecated in Leads API)
-        note_content = f"Use Case: {data.get('usecase')}\n\nQuelle: Better Call HENK Beta Landing Page" if data.get('usecase') else 'Quelle: Better Call HENK Beta Landing Page'
+        note_content = f'Use Case: {usecase}\n\n{_NOTE_SOURCE}' if usecase else _NOTE_SOURCE
 
         note_data = {
             'content': note_content,
@@ -72,15 +117,15 @@ def send_to_pipedrive(data):
             'pinned_to_lead_flag': 1
         }
 
-        note_response = requests.post(
-            f'{base_url}/notes',
-            params=params,
-            json=note_data,
+        note_response = _pipedrive_session.post(
+            _PD_NOTES_URL,
+            params=_PD_PARAMS,
+            data=orjson.dumps(note_data),
             timeout=10
         )
 
         if note_response.ok:
-            print(f"✓ Pipedrive Lead + Note created for {data.get('email')}")
+            print(f"✓ Pipedrive Lead + Note created for {email or whatsapp}")
             return True
         else:
             print(f"⚠ Lead created but Note failed: {note_response.status_code}")
@@ -91,46 +136,167 @@ def send_to_pipedrive(data):
         print(f"Pipedrive Error: {str(e)}")
         return False
 
+def _now_iso():
+    """UTC timestamp in ISO 8601 with microseconds, e.g. 2025-01-01T12:00:00.000000Z"""
+    t = time()
+    return f"{strftime('%Y-%m-%dT%H:%M:%S', gmtime(t))}.{int(t % 1 * 1e6):06d}Z"
+
+# Lead storage (CSV)
+_CSV_PATH = os.path.join('storage', 'leads.csv')
+_CSV_FIELDS = ('ts', 'name', 'email', 'whatsapp', 'usecase')
+os.makedirs('storage', exist_ok=True)
+
+def _csv_escape(value):
+    """Quote a single CSV field the way csv.QUOTE_MINIMAL would"""
+    if not isinstance(value, str):
+        value = '' if value is None else str(value)
+    if ',' in value or '"' in value or '\n' in value or '\r' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _csv_line(values):
+    return ','.join(map(_csv_escape, values)) + '\r\n'
+
+_CSV_HEADER = _csv_line(_CSV_FIELDS)
+
+# Create the file with its header at startup; 'x' fails atomically if another
+# worker got there first, so concurrently starting workers never double the header
+try:
+    with open(_CSV_PATH, 'x', newline='', encoding='utf-8') as f:
+        f.write(_CSV_HEADER)
+except FileExistsError:
+    pass
+
+def _append_csv(fd, text):
+    """
+    Append text to the CSV with a single O_APPEND write.
+    Several gunicorn workers each run their own writer, so a batch must reach
+    the file in one syscall to keep lines from different processes intact.
+    """
+    # Lone surrogates from the JSON body must not stop the writer
+    data = memoryview(text.encode('utf-8', errors='backslashreplace'))
+    while data:
+        data = data[os.write(fd, data):]
+
+def _write_csv_batch(text):
+    """
+    Append rows to leads.csv, recreating it with a header if it was moved or
+    deleted after startup. A recreated file is written to a temp file first
+    and published with os.link, which fails atomically if another worker got
+    there first - so the header is written exactly once and always on top.
+    """
+    while True:
+        try:
+            fd = os.open(_CSV_PATH, os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            tmp_path = f'{_CSV_PATH}.{os.getpid()}.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                _append_csv(fd, _CSV_HEADER + text)
+            finally:
+                os.close(fd)
+            try:
+                os.link(tmp_path, _CSV_PATH)
+                return
+            except FileExistsError:
+                # Another worker recreated it meanwhile - append to theirs
+                continue
+            finally:
+                os.unlink(tmp_path)
+
+        try:
+            _append_csv(fd, text)
+            return
+        finally:
+            os.close(fd)
+
+def _csv_writer_loop():
+    """
+    Append queued leads to storage/leads.csv.
+    Writes rows in batches until a None sentinel is received. The file is
+    reopened for every batch, so a renamed or rotated leads.csv is picked up.
+    """
+    while True:
+        batch = [_lead_queue.get()]
+        while len(batch) < 64:
+            try:
+                batch.append(_lead_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        rows = [row for row in batch if row is not None]
+        if rows:
+            try:
+                _write_csv_batch(''.join(_csv_line([row[k] for k in _CSV_FIELDS]) for row in rows))
+            except Exception as e:
+                # Keep the writer alive for later leads
+                print(f"CSV Error: {len(rows)} lead(s) not saved: {str(e)}")
+
+        if len(rows) != len(batch):
+            return
+
+# Single background writer, so /api/subscribe never blocks on disk I/O
+_lead_queue = queue.Queue()
+_csv_writer = threading.Thread(target=_csv_writer_loop, name='csv-writer', daemon=True)
+_csv_writer.start()
+
+@atexit.register
+def _drain_lead_queue():
+    # Make sure queued leads hit the disk before the process exits
+    _lead_queue.put(None)
+    _csv_writer.join(timeout=5)
+
+# The pages are fully static, so each template is rendered only once per process
+_rendered_pages = {}
+
+def _static_page(template):
+    """
+    Serve a pre-rendered template with browser caching.
+    In debug mode the template is re-rendered on every request so edits show up.
+    """
+    html = _rendered_pages.get(template)
+    if html is None or app.debug:
+        html = _rendered_pages[template] = render_template(template).encode('utf-8')
+    return app.response_class(html, mimetype='text/html', headers={'Cache-Control': 'public, max-age=300'})
+
 @app.route('/')
 def home():
-    return render_template('index.html')
+    return _static_page('index.html')
 
 @app.route('/impressum')
 def impressum():
-    return render_template('impressum.html')
+    return _static_page('impressum.html')
 
 @app.route('/datenschutz')
 def datenschutz():
-    return render_template('datenschutz.html')
+    return _static_page('datenschutz.html')
 
 @app.route('/agb')
 def agb():
-    return render_template('agb.html')
+    return _static_page('agb.html')
+
+# Constant body of every /api/subscribe answer, encoded once
+_OK_BODY = orjson.dumps({'ok': True})
 
 @app.post('/api/subscribe')
 def subscribe():
     payload = request.get_json(force=True, silent=True) or {}
     row = {
-        'ts': datetime.utcnow().isoformat()+'Z',
+        'ts': _now_iso(),
         'name': payload.get('name',''),
         'email': payload.get('email',''),
         'whatsapp': payload.get('whatsapp',''),
         'usecase': payload.get('usecase','')
     }
 
-    # Save to CSV (primary storage)
-    os.makedirs('storage', exist_ok=True)
-    path = os.path.join('storage', 'leads.csv')
-    exists = os.path.exists(path)
-    with open(path, 'a', newline='', encoding='utf-8') as f:
-        w = csv.DictWriter(f, fieldnames=row.keys())
-        if not exists: w.writeheader()
-        w.writerow(row)
+    # Save to CSV (primary storage, written by the background writer)
+    _lead_queue.put(row)
 
     # Send to Pipedrive (optional, non-blocking)
-    send_to_pipedrive(payload)
+    _pipedrive_executor.submit(send_to_pipedrive, payload)
 
-    return jsonify({'ok': True})
+    # Fresh Response per request (Flask may mutate it), built from the cached bytes
+    return app.response_class(_OK_BODY, mimetype='application/json')
 
 if __name__ == '__main__':
     app.run(debug=True, port=8080)